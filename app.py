@@ -1,52 +1,515 @@
-from flask import Flask, request, render_template, jsonify, send_from_directory
-from playwright.sync_api import sync_playwright
-import uuid
+from flask import Flask, Response, abort, request, render_template, jsonify, send_file, send_from_directory
+from werkzeug.serving import is_running_from_reloader
+from browser_pool import BrowserPool
+from page_assets import ASSET_ORIGIN, ASSETS_DIR, install_asset_routes, missing_assets, require_assets, wait_until_ready
+from image_store import ImageStore, content_etag
+from image_variants import DEFAULT_QUALITY, FORMATS, encode, ensure_format_variant, ensure_thumbnails, extension, negotiate
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, RENDERS_IN_FLIGHT, generate_latest, stage_timer
+from pillow_renderer import PillowRenderer
+from render_cache import RenderCache, digest_paths, normalize_name
+from render_queue import RenderQueue, QueueFull, DONE, FAILED
+from PIL import __version__ as PILLOW_VERSION, features
+import base64
+import importlib.metadata
+import inspect
+import io
+import json
+import mimetypes
+import queue
+import time
 import os
 
 app = Flask(__name__)
+# Cache keys follow the template file's contents, so renders must pick up
+# edits too; Flask only reloads templates on its own in debug mode
+app.config['TEMPLATES_AUTO_RELOAD'] = True
+
+# `python app.py` runs the debug reloader: its parent process only watches
+# files and restarts the child, so it must not start browsers or sweepers
+SERVING_PROCESS = __name__ != '__main__' or is_running_from_reloader()
 
 # Use environment variable for images directory, default to ./images for local
 IMAGES_DIR = os.environ.get('IMAGES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images'))
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
+# Images are sharded under IMAGES_DIR and swept by age and total size
+image_store = ImageStore(
+    IMAGES_DIR,
+    max_age=float(os.environ.get('IMAGE_RETENTION_DAYS', 30)) * 86400,
+    max_bytes=int(float(os.environ.get('IMAGE_QUOTA_MB', 5120)) * 1024 * 1024),
+    sweep_interval=float(os.environ.get('IMAGE_SWEEP_INTERVAL', 300)),
+)
+if SERVING_PROCESS:
+    image_store.start_sweeper()
+
+# Warm Chromium pages shared by all requests, launched at startup
+browser_pool = BrowserPool(
+    size=int(os.environ.get('BROWSER_POOL_SIZE', 2)),
+    max_renders_per_page=int(os.environ.get('BROWSER_MAX_RENDERS_PER_PAGE', 200)),
+    retry_interval=float(os.environ.get('BROWSER_RETRY_INTERVAL', 30)),
+    viewport={'width': 1000, 'height': 600},
+    page_setup=install_asset_routes,
+)
+if SERVING_PROCESS and missing_assets():
+    app.logger.error('Not starting the browser pool: pendant assets are missing, run fetch_assets.py')
+elif SERVING_PROCESS:
+    try:
+        browser_pool.start()
+    except RuntimeError as exc:
+        # Pillow renders still work; Chromium renders retry the launch and fail fast
+        app.logger.error('Browser pool did not start: %s', exc)
+
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))
+# Upper bound on waiting for fonts/images before screenshotting anyway
+READY_TIMEOUT_MS = int(os.environ.get('READY_TIMEOUT_MS', 5000))
+
+def render_version():
+    """Digest of what shapes a render besides the template and request options.
+
+    Covers the vendored fonts and chain images, the Pillow renderer's code
+    and the Chromium (via Playwright), Pillow and FreeType versions, so an
+    asset refresh or upgrade produces new filenames instead of new bytes
+    under old, long-cached URLs.
+    """
+    return digest_paths(
+        [ASSETS_DIR, inspect.getsourcefile(PillowRenderer)],
+        importlib.metadata.version('playwright'), PILLOW_VERSION, features.version('freetype2'),
+    )
+
+# Rendered images keyed by name + template + render version + options, shared across requests
+render_cache = RenderCache(
+    image_store,
+    os.path.join(app.root_path, app.template_folder, 'pendant_template.html'),
+    max_entries=int(os.environ.get('RENDER_CACHE_ENTRIES', 4096)),
+    version=render_version(),
+)
+
+# Render jobs wait here instead of holding a Flask worker for the whole render
+render_queue = RenderQueue(
+    workers=int(os.environ.get('RENDER_WORKERS', browser_pool.size)),
+    max_depth=int(os.environ.get('RENDER_QUEUE_DEPTH', 64)),
+    deadline=float(os.environ.get('RENDER_JOB_DEADLINE', 60)),
+)
+Gauge('pendant_render_queue_depth', 'Render jobs waiting for a worker.', callback=render_queue.depth)
+Counter('pendant_cache_hits', 'Requests answered from the render cache.', callback=lambda: render_cache.hits)
+Counter('pendant_cache_misses', 'Requests that needed a fresh render.', callback=lambda: render_cache.misses)
+Gauge('pendant_images_stored', 'Rendered image files on disk.', callback=lambda: image_store.stats()['files'])
+Gauge('pendant_images_stored_bytes', 'Total size of rendered images on disk.', callback=lambda: image_store.stats()['bytes'])
+Counter('pendant_images_evicted', 'Images deleted by the retention/quota sweeper.', callback=lambda: image_store.evictions)
+MAX_JOB_WAIT = float(os.environ.get('MAX_JOB_WAIT', 30))
+# Device scale factors clients may ask for; each one keeps its own warm page per browser
+SCALES = tuple(float(s) for s in os.environ.get('RENDER_SCALES', '1,1.5,2,3').split(','))
+MAX_THUMBNAILS = int(os.environ.get('MAX_THUMBNAILS', 4))
+# Filenames include the render version, so caches may keep images for a year
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 31536000))
+RESPONSE_MODES = ('url', 'inline', 'base64')
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 100))
+# Extra render time allowed per item on top of RENDER_TIMEOUT for batches
+BATCH_ITEM_TIMEOUT = float(os.environ.get('BATCH_ITEM_TIMEOUT', 2))
+
+# Default render backend: 'chromium', or 'pillow' to skip the browser when possible
+RENDER_ENGINE = os.environ.get('RENDER_ENGINE', 'chromium')
+ENGINES = ('chromium', 'pillow')
+pillow_renderer = PillowRenderer(viewport_width=browser_pool.viewport['width'])
+
+# Font choices offered to clients, mapped to the CSS font stacks in the template
+FONTS = {
+    'pacifico': "'Pacifico', cursive",
+    'sacramento': "'Sacramento', cursive",
+    'amiri': "'Amiri', serif",
+    'cairo': "'Cairo', sans-serif",
+    'noto-naskh-arabic': "'Noto Naskh Arabic', serif",
+}
+ARABIC_FONTS = {'amiri', 'cairo', 'noto-naskh-arabic'}
+
+def is_integer(value):
+    # JSON true/false arrive as bools, which are ints to isinstance
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_pendant(data):
+    """Validate one render request item into a pendant dict.
+
+    Items carry ``name``, ``font``, ``direction`` and ``engine`` plus output
+    options: ``format`` (png/webp/jpeg), ``quality``, ``scale`` (device scale
+    factor, one of ``SCALES``) and ``thumbnails`` (list of widths).
+    """
+    if not isinstance(data, dict):
+        raise ValueError("each pendant must be an object")
+    name = data.get('name', 'Thaamu')
+    if not isinstance(name, str):
+        raise ValueError("name must be a string")
+    font = data.get('font', 'pacifico')
+    if font not in FONTS:
+        raise ValueError(f"unknown font {font!r}, expected one of {sorted(FONTS)}")
+    direction = data.get('direction') or ('rtl' if font in ARABIC_FONTS else 'ltr')
+    if direction not in ('ltr', 'rtl'):
+        raise ValueError("direction must be 'ltr' or 'rtl'")
+    engine = data.get('engine') or RENDER_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {list(ENGINES)}")
+    fmt = data.get('format', 'png')
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+    quality = None
+    if fmt != 'png':
+        quality = data.get('quality', DEFAULT_QUALITY)
+        if not is_integer(quality) or not 1 <= quality <= 100:
+            raise ValueError("quality must be an integer from 1 to 100")
+    scale = data.get('scale', 1)
+    if not (is_integer(scale) or isinstance(scale, float)) or float(scale) not in SCALES:
+        raise ValueError(f"scale must be one of {list(SCALES)}")
+    # 1 and 1.0 must map to the same cache key
+    scale = float(scale)
+    thumbnails = data.get('thumbnails', [])
+    if (not isinstance(thumbnails, list) or len(thumbnails) > MAX_THUMBNAILS
+            or not all(is_integer(w) and 16 <= w <= 2048 for w in thumbnails)):
+        raise ValueError(f"thumbnails must be a list of at most {MAX_THUMBNAILS} widths from 16 to 2048")
+    pendant = {
+        'name': normalize_name(name),
+        'font': font,
+        'direction': direction,
+        'format': fmt,
+        'quality': quality,
+        'scale': scale,
+        'thumbnails': sorted(set(thumbnails)),
+    }
+    # Fall back to Chromium for anything Pillow can't reproduce faithfully
+    if engine == 'pillow' and (scale != 1 or not pillow_renderer.supports(pendant)):
+        engine = 'chromium'
+    pendant['engine'] = engine
+    return pendant
+
+def cache_options(pendant):
+    return {
+        'viewport': browser_pool.viewport,
+        'font': pendant['font'],
+        'direction': pendant['direction'],
+        'engine': pendant['engine'],
+        'format': pendant['format'],
+        'quality': pendant['quality'],
+        'scale': pendant['scale'],
+    }
+
+def render_pendant_html(pendants):
+    # Render the Jinja2 HTML (jobs run outside the request context)
+    with stage_timer('jinja_render'), app.app_context():
+        return render_template("pendant_template.html", pendants=pendants, fonts=FONTS, asset_origin=ASSET_ORIGIN)
+
+def open_pendant_page(page, rendered_html):
+    # Feed the HTML straight into the page; no temporary files involved
+    with stage_timer('set_content'):
+        page.set_content(rendered_html)
+    with stage_timer('readiness_wait'):
+        wait_until_ready(page, READY_TIMEOUT_MS)
+    
+    # Screenshot only the pendant-wrapper for a zoomed-in effect
+    return page.locator('.pendant-wrapper')
+
+def render_pendant(pendant):
+    """Render one pendant in Chromium and return the PNG bytes."""
+    # Never screenshot (and cache) a page without its fonts and chain images
+    require_assets()
+    rendered_html = render_pendant_html([pendant])
+    
+    # Render the page to screenshot on a pooled browser page
+    def render(page):
+        wrappers = open_pendant_page(page, rendered_html)
+        with stage_timer('screenshot'):
+            return wrappers.first.screenshot(animations='disabled')
+    
+    with RENDERS_IN_FLIGHT.track(), stage_timer('total'):
+        return browser_pool.run(render, timeout=RENDER_TIMEOUT, device_scale_factor=pendant['scale'])
+
+def render_pendant_pillow(pendant):
+    """Render one pendant without a browser and return the Pillow image."""
+    with RENDERS_IN_FLIGHT.track(), stage_timer('pillow_render'):
+        return pillow_renderer.render_image(pendant)
+
+def render_pendant_batch(pendants, results):
+    """Render ``pendants`` with one page load per scale, putting ``(index, png)`` on ``results``."""
+    require_assets()
+    by_scale = {}
+    for index, pendant in enumerate(pendants):
+        by_scale.setdefault(pendant['scale'], []).append(index)
+    
+    for scale, indexes in by_scale.items():
+        rendered_html = render_pendant_html([pendants[i] for i in indexes])
+        
+        def render(page, indexes=indexes, rendered_html=rendered_html):
+            wrappers = open_pendant_page(page, rendered_html)
+            for position, index in enumerate(indexes):
+                with stage_timer('screenshot'):
+                    png = wrappers.nth(position).screenshot(animations='disabled')
+                results.put((index, png))
+        
+        with RENDERS_IN_FLIGHT.track(), stage_timer('batch_total'):
+            browser_pool.run(
+                render,
+                timeout=RENDER_TIMEOUT + BATCH_ITEM_TIMEOUT * len(indexes),
+                device_scale_factor=scale,
+            )
+
+def pendant_result(pendant, filename, cached, master=None):
+    # Thumbnails come from the in-memory render when there is one
+    thumbnails = ensure_thumbnails(
+        image_store, filename, pendant['thumbnails'], pendant['format'], pendant['quality'], master
+    )
+    # Construct the public URL for Railway (served by Flask)
+    result = {
+        "url": f"/images/{filename}",
+        "file_path": image_store.path(filename),
+        "cached": cached
+    }
+    if thumbnails:
+        result["thumbnails"] = {str(width): f"/images/{name}" for width, name in thumbnails.items()}
+    return result
+
+def lookup_pendant(pendant):
+    """Return the result for an already-rendered pendant, or None."""
+    filename = render_cache.lookup(pendant['name'], cache_options(pendant), extension(pendant['format']))
+    if filename is None:
+        return None
+    return pendant_result(pendant, filename, True)
+
+def store_pendant(pendant, render):
+    """Render ``pendant`` through the cache, encoding its format and thumbnails in one pass.
+
+    ``render()`` returns the master image (PNG bytes or a Pillow image). The
+    encoded files are persisted in the background.
+    """
+    master = None
+    
+    def encoded():
+        nonlocal master
+        master = render()
+        return encode(master, pendant['format'], pendant['quality'])
+    
+    # Identical requests reuse the image already on disk
+    filename, cached = render_cache.get_or_render(
+        pendant['name'], cache_options(pendant), encoded, extension(pendant['format'])
+    )
+    return pendant_result(pendant, filename, cached, master)
+
+def submit_pendant_job():
+    """Queue a render for the request's pendant, or answer straight from the cache.
+
+    Returns ``(job, result)``; exactly one of them is set.
+    """
+    pendant = parse_pendant(request.get_json(silent=True) or {})
+    
+    # Cached names never wait behind the render queue
+    result = lookup_pendant(pendant)
+    if result is not None:
+        return None, result
+    
+    # Pillow renders take milliseconds, so they skip the queue too
+    if pendant['engine'] == 'pillow':
+        return None, store_pendant(pendant, lambda: render_pendant_pillow(pendant))
+    
+    return render_queue.submit(lambda: store_pendant(pendant, lambda: render_pendant(pendant))), None
+
+def response_mode():
+    """How the client wants the image: 'url' (default), 'inline' bytes or 'base64' JSON."""
+    mode = request.args.get('response') or ('inline' if request.args.get('inline', type=int) else 'url')
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"response must be one of {list(RESPONSE_MODES)}")
+    return mode
+
+def result_filename(result):
+    return result["url"].rsplit('/', 1)[-1]
+
+def written(result):
+    """Wait for ``result``'s image to reach disk, so its file_path exists once returned."""
+    if result is not None and "url" in result:
+        image_store.wait_written(result_filename(result), RENDER_TIMEOUT)
+    return result
+
+def pendant_response(result, mode):
+    filename = result_filename(result)
+    if mode == 'url':
+        return jsonify(written(result))
+    # Fresh renders are still in memory while the store writes them out
+    data = image_store.read(filename)
+    mimetype = mimetypes.guess_type(filename)[0]
+    if mode == 'base64':
+        return jsonify({**written(result), "content_type": mimetype, "image_base64": base64.b64encode(data).decode('ascii')})
+    response = Response(data, mimetype=mimetype)
+    response.headers['Content-Location'] = result["url"]
+    response.headers['X-Pendant-Cached'] = '1' if result["cached"] else '0'
+    response.set_etag(content_etag(data))
+    return response
+
+def queue_full_response(exc):
+    response = jsonify({"error": str(exc)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
 @app.route('/generate-pendant', methods=['POST'])
 def generate_pendant():
-    name = request.json.get('name', 'Thaamu')
-    unique_id = uuid.uuid4().hex
-    html_file = f"render_{unique_id}.html"
-    output_file = os.path.join(IMAGES_DIR, f"pendant_{unique_id}.png")
+    try:
+        mode = response_mode()
+        job, result = submit_pendant_job()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except QueueFull as exc:
+        return queue_full_response(exc)
+    if result is not None:
+        return pendant_response(result, mode)
     
-    # Render the Jinja2 HTML with name
-    rendered_html = render_template("pendant_template.html", name=name)
+    # Synchronous wrapper: wait for the queued job to finish
+    job.wait(max(0, job.deadline - time.monotonic()) + RENDER_TIMEOUT)
+    if job.status == DONE:
+        return pendant_response(job.result, mode)
+    if job.status == FAILED:
+        return jsonify(job.to_dict()), 500
+    return jsonify(job.to_dict()), 504
+
+@app.route('/generate-pendants', methods=['POST'])
+def generate_pendants():
+    """Render many pendants in one page load, streaming NDJSON lines as each finishes."""
+    body = request.get_json(silent=True)
+    items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {BATCH_MAX_ITEMS} items per batch"}), 400
+    try:
+        mode = response_mode()
+        pendants = [parse_pendant(item) for item in items]
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if mode == 'inline':
+        return jsonify({"error": "batches can't return inline images; use response=base64 or url"}), 400
     
-    # Save temporary HTML file
-    with open(html_file, 'w', encoding='utf-8') as f:
-        f.write(rendered_html)
-        
+    # Cached and Pillow items are answered inline; only the rest go to the browser
+    cached = {}
+    inline = []
+    misses = []
+    for index, pendant in enumerate(pendants):
+        result = lookup_pendant(pendant)
+        if result is not None:
+            cached[index] = result
+        elif pendant['engine'] == 'pillow':
+            inline.append(index)
+        else:
+            misses.append(index)
     
-    # Launch Playwright and render the page to screenshot
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page(viewport={'width': 1000, 'height': 600})
-        page.goto(f'file://{os.path.abspath(html_file)}')
-        page.wait_for_timeout(1000)  # wait for fonts/images to load
-        # Screenshot only the pendant-wrapper for a zoomed-in effect
-        pendant_wrapper = page.locator('.pendant-wrapper')
-        pendant_wrapper.screenshot(path=output_file)
-        browser.close()
+    results = queue.Queue()
+    job = None
+    if misses:
+        try:
+            job = render_queue.submit(
+                lambda: render_pendant_batch([pendants[i] for i in misses], results) or {}
+            )
+        except QueueFull as exc:
+            return queue_full_response(exc)
     
-    os.remove(html_file)  # Clean up
+    def line(index, data):
+        if mode == 'base64' and "url" in data:
+            image = image_store.read(result_filename(data))
+            data = {**data, "image_base64": base64.b64encode(image).decode('ascii')}
+        return json.dumps({"index": index, "name": pendants[index]['name'], **written(data)}) + "\n"
     
-    # Construct the public URL for Railway (served by Flask)
-    public_url = f"/images/{os.path.basename(output_file)}"
-    return jsonify({
-        "url": public_url,
-        "file_path": output_file
-    })
+    def stream():
+        for index, result in cached.items():
+            yield line(index, result)
+        for index in inline:
+            pendant = pendants[index]
+            yield line(index, store_pendant(pendant, lambda: render_pendant_pillow(pendant)))
+        pending = set(misses)
+        while pending:
+            try:
+                position, png = results.get(timeout=0.5)
+            except queue.Empty:
+                if job.done and results.empty():
+                    break
+                continue
+            index = misses[position]
+            pending.discard(index)
+            yield line(index, store_pendant(pendants[index], lambda: png))
+        # Anything left over failed with the job
+        for index in sorted(pending):
+            yield line(index, {"error": job.error or "render failed", "status": job.status})
+    
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    try:
+        job, result = submit_pendant_job()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except QueueFull as exc:
+        return queue_full_response(exc)
+    if result is not None:
+        return jsonify({"status": DONE, **written(result)})
+    response = jsonify({**job.to_dict(), "status_url": f"/jobs/{job.id}"})
+    response.status_code = 202
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    # Long-poll: ?wait=<seconds> blocks until the job finishes or the time runs out
+    wait = min(request.args.get('wait', 0, type=float), MAX_JOB_WAIT)
+    if wait > 0:
+        job.wait(wait)
+    written(job.result)
+    return jsonify(job.to_dict())
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(render_cache.stats())
+
+@app.route('/storage-stats')
+def storage_stats():
+    return jsonify(image_store.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(generate_latest(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    return send_from_directory(IMAGES_DIR, filename)
+    # Browsers that prefer WebP get a transcoded copy of PNG renders
+    negotiated = negotiate(filename, request.accept_mimetypes)
+    if negotiated is not None:
+        try:
+            filename = ensure_format_variant(image_store, filename, negotiated)
+        except FileNotFoundError:
+            abort(404)
+    
+    # ETags follow the bytes, not the filename: a file re-rendered after an
+    # eviction gets a new one, so If-Range never splices two renders together.
+    # send_file handles conditional and Range requests.
+    pending = image_store.pending(filename)
+    if pending is not None:
+        # Rendered moments ago and not written out yet: serve it from memory
+        response = send_file(
+            io.BytesIO(pending), mimetype=mimetypes.guess_type(filename)[0],
+            max_age=IMAGE_MAX_AGE, etag=content_etag(pending), last_modified=time.time(),
+        )
+    else:
+        # URLs stay flat; the store knows which shard holds the file
+        relpath = image_store.relpath(filename)
+        if relpath is None:
+            abort(404)
+        image_store.touch(filename)
+        try:
+            # The hash kept in the index matches the one sent while pending
+            etag = image_store.etag(filename)
+        except FileNotFoundError:
+            abort(404)
+        response = send_from_directory(IMAGES_DIR, relpath, max_age=IMAGE_MAX_AGE, etag=etag)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if filename.endswith('.png') or negotiated is not None:
+        response.vary.add('Accept')
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8082))
@@ -0,0 +1,225 @@
+"""Load-test the pendant renderer and report throughput and per-stage latency.
+
+By default the app is started in-process on a free port with stub assets
+(generated chain images and a system font standing in for the vendored
+ones), so runs are reproducible offline. Point ``--url`` at a running server
+to benchmark a real deployment instead.
+
+    python benchmark.py --requests 200 --concurrency 8
+    python benchmark.py --engine pillow --unique --json results.json
+
+Per-stage percentiles are estimated from the ``/metrics`` histograms the
+same way Prometheus' ``histogram_quantile`` does.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+PERCENTILES = (0.5, 0.95, 0.99)
+BUCKET_LINE = re.compile(r'^pendant_render_stage_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\S+)$')
+
+
+def make_stub_assets(directory):
+    """Write stand-in fonts and chain images so renders never touch the network."""
+    from PIL import Image, ImageDraw
+
+    images = os.path.join(directory, 'images')
+    fonts = os.path.join(directory, 'fonts')
+    os.makedirs(images)
+    os.makedirs(os.path.join(fonts, 'ttf'))
+    for filename in ('chain-left.png', 'chain-right.png'):
+        chain = Image.new('RGBA', (120, 320), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(chain)
+        for y in range(0, 320, 32):
+            draw.ellipse((30, y, 90, y + 40), outline=(212, 175, 55, 255), width=6)
+        chain.save(os.path.join(images, filename))
+
+    system_fonts = sorted(glob.glob('/usr/share/fonts/**/*.ttf', recursive=True))
+    css = ''
+    if system_fonts:
+        with open(system_fonts[0], 'rb') as f:
+            font = f.read()
+        for family, filename in (('Pacifico', 'Pacifico.ttf'), ('Sacramento', 'Sacramento.ttf')):
+            for path in (os.path.join(fonts, filename), os.path.join(fonts, 'ttf', filename)):
+                with open(path, 'wb') as f:
+                    f.write(font)
+            css += f"@font-face {{ font-family: '{family}'; src: url({filename}); }}\n"
+    with open(os.path.join(fonts, 'fonts.css'), 'w') as f:
+        f.write(css)
+
+
+def start_local_server(workdir):
+    """Run the app on a free port in this process, using stub assets."""
+    os.environ.setdefault('ASSETS_DIR', os.path.join(workdir, 'assets'))
+    os.environ.setdefault('IMAGES_DIR', os.path.join(workdir, 'images'))
+    if not os.path.isdir(os.environ['ASSETS_DIR']):
+        make_stub_assets(os.environ['ASSETS_DIR'])
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def post(url, payload, timeout):
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - start
+
+
+def scrape_stage_buckets(base_url):
+    """Return ``{stage: [(le, cumulative_count), ...]}`` from ``/metrics``."""
+    with urllib.request.urlopen(f'{base_url}/metrics', timeout=10) as resp:
+        text = resp.read().decode('utf-8')
+    stages = {}
+    for line in text.splitlines():
+        match = BUCKET_LINE.match(line)
+        if match:
+            stage, le, count = match.groups()
+            stages.setdefault(stage, []).append((float(le.replace('+Inf', 'inf')), float(count)))
+    return stages
+
+
+def histogram_quantile(q, buckets):
+    """Linear interpolation within cumulative buckets, as in PromQL."""
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def stage_deltas(before, after):
+    deltas = {}
+    for stage, buckets in after.items():
+        previous = dict(before.get(stage, []))
+        deltas[stage] = [(le, count - previous.get(le, 0)) for le, count in buckets]
+    return deltas
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='pendant-bench-')
+    server = None
+    base_url = args.url.rstrip('/') if args.url else None
+    if base_url is None:
+        base_url, server = start_local_server(workdir)
+
+    endpoint = f'{base_url}{args.endpoint}'
+    payloads = []
+    for i in range(args.requests):
+        payload = {'name': f'{args.name}{i}' if args.unique else args.name}
+        if args.engine:
+            payload['engine'] = args.engine
+        payloads.append(payload)
+
+    # One untimed request so browser launch doesn't skew the first sample
+    if args.warmup:
+        post(endpoint, {'name': f'{args.name}-warmup', **({'engine': args.engine} if args.engine else {})}, args.timeout)
+
+    before = scrape_stage_buckets(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda p: post(endpoint, p, args.timeout), payloads))
+    elapsed = time.perf_counter() - started
+    stages = stage_deltas(before, scrape_stage_buckets(base_url))
+
+    latencies = [latency for status, latency in results if status == 200]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    report = {
+        'endpoint': endpoint,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'elapsed_seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0,
+        'statuses': statuses,
+        'latency_seconds': {f'p{int(q * 100)}': percentile(latencies, q) for q in PERCENTILES},
+        'stages_seconds': {
+            stage: {f'p{int(q * 100)}': histogram_quantile(q, buckets) for q in PERCENTILES}
+            for stage, buckets in sorted(stages.items()) if buckets and buckets[-1][1] > 0
+        },
+    }
+    if server is not None:
+        server.shutdown()
+    return report
+
+
+def print_report(report):
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:9.2f}'
+
+    print(f"{report['requests']} requests to {report['endpoint']} at concurrency {report['concurrency']}")
+    print(f"elapsed {report['elapsed_seconds']:.2f}s, throughput {report['throughput_rps']:.1f} req/s, "
+          f"statuses {report['statuses']}")
+    print(f"{'':18}{'p50 ms':>9}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [('request', report['latency_seconds'])] + list(report['stages_seconds'].items())
+    for label, values in rows:
+        print(f"{label:18}{ms(values['p50'])} {ms(values['p95'])} {ms(values['p99'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of an in-process one')
+    parser.add_argument('--endpoint', default='/generate-pendant')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--name', default='Thaamu')
+    parser.add_argument('--unique', action='store_true', help='use a distinct name per request to bypass the cache')
+    parser.add_argument('--engine', choices=['chromium', 'pillow'])
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""A pool of long-lived Chromium pages for rendering pendants.
+
+Playwright's sync API is bound to the thread that started it, so every
+browser in the pool is owned by its own worker thread. Callers never touch
+a page directly: they hand a callable to ``BrowserPool.run`` which checks out
+an idle worker, runs the callable against that worker's page and returns the
+result.
+
+``start`` launches every browser and its default page up front, so the
+first request doesn't pay for it; if no browser can start it raises, and
+``submit`` keeps failing fast instead of queueing work nobody will run. A
+failed start is remembered and retried at most once per ``retry_interval``,
+by a single caller, while everyone else gets the cached error right away.
+"""
+from concurrent.futures import Future
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+
+from metrics import BROWSER_CRASHES, stage_timer
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BrowserPool:
+    def __init__(self, size=2, max_renders_per_page=200, viewport=None, launch_options=None, page_setup=None,
+                 retry_interval=30):
+        self.size = max(1, int(size))
+        self.max_renders_per_page = max(1, int(max_renders_per_page))
+        self.viewport = viewport or {'width': 1000, 'height': 600}
+        self.launch_options = launch_options or {}
+        self.page_setup = page_setup
+        self.retry_interval = retry_interval
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        # Last startup error message and when it happened, so callers don't each relaunch
+        self._failure = None
+        self._failed_at = None
+
+    def start(self):
+        """Launch every worker's browser and warm page; raises if none come up."""
+        if self._started:
+            return
+        # After a failure, a retry already in progress isn't worth waiting for
+        failure = self._failure
+        if not self._lock.acquire(blocking=failure is None):
+            raise RuntimeError(failure)
+        try:
+            self._start()
+        finally:
+            self._lock.release()
+
+    def _start(self):
+        if self._started:
+            return
+        if self._closed:
+            raise RuntimeError('browser pool has been shut down')
+        if self._failure is not None and time.monotonic() - self._failed_at < self.retry_interval:
+            raise RuntimeError(self._failure)
+        errors = []
+        for i in range(self.size):
+            ready = threading.Event()
+            thread = threading.Thread(
+                target=self._worker, args=(ready, errors), name=f'browser-pool-{i}', daemon=True
+            )
+            failed = len(errors)
+            thread.start()
+            ready.wait()
+            if len(errors) == failed:
+                self._threads.append(thread)
+        if not self._threads:
+            self._failure = f'no browser could be started: {errors[0]}'
+            self._failed_at = time.monotonic()
+            raise RuntimeError(self._failure) from errors[0]
+        self._failure = None
+        if errors:
+            logger.warning('Browser pool started %d of %d browsers', len(self._threads), self.size)
+        self._started = True
+        atexit.register(self.shutdown)
+
+    def run(self, fn, timeout=None, device_scale_factor=1):
+        """Run ``fn(page)`` on the next free page and return its result."""
+        return self.submit(fn, device_scale_factor).result(timeout=timeout)
+
+    def submit(self, fn, device_scale_factor=1):
+        if self._closed:
+            raise RuntimeError('browser pool has been shut down')
+        self.start()
+        if not any(thread.is_alive() for thread in self._threads):
+            raise RuntimeError('browser pool has no running browsers')
+        future = Future()
+        self._tasks.put((fn, future, device_scale_factor))
+        return future
+
+    def shutdown(self, timeout=10):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._tasks.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _worker(self, ready, errors):
+        p = browser = None
+        # One warm page per device scale factor: scale -> [context, page, renders]
+        pages = {}
+        try:
+            with stage_timer('playwright_start'):
+                p = sync_playwright().start()
+            browser = self._launch(p)
+            pages[1] = self._new_page(browser, 1)
+        except Exception as exc:
+            logger.exception('Could not start a browser for the pool')
+            errors.append(exc)
+            if browser is not None:
+                self._close_quietly(browser)
+            if p is not None:
+                p.stop()
+            return
+        finally:
+            ready.set()
+        try:
+            self._serve(p, browser, pages)
+        finally:
+            p.stop()
+
+    def _launch(self, p):
+        with stage_timer('browser_launch'):
+            return p.chromium.launch(**self.launch_options)
+
+    def _serve(self, p, browser, pages):
+        while True:
+            task = self._tasks.get()
+            if task is _STOP:
+                break
+            fn, future, scale = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if not browser.is_connected():
+                    pages.clear()
+                    browser = self._launch(p)
+                slot = pages.get(scale)
+                if slot is None or slot[1].is_closed():
+                    self._discard(pages, scale)
+                    slot = pages[scale] = self._new_page(browser, scale)
+                future.set_result(fn(slot[1]))
+                slot[2] += 1
+                if slot[2] >= self.max_renders_per_page:
+                    self._discard(pages, scale)
+            except BaseException as exc:
+                future.set_exception(exc)
+                # Treat any browser-side failure as a crash: throw the page
+                # away so the next render starts from a clean context.
+                if isinstance(exc, PlaywrightError):
+                    logger.warning('Render failed, recycling page: %s', exc)
+                    BROWSER_CRASHES.inc()
+                    self._discard(pages, scale)
+                if not isinstance(exc, Exception):
+                    raise
+        self._close_quietly(browser)
+
+    def _new_page(self, browser, scale):
+        context = browser.new_context(viewport=self.viewport, device_scale_factor=scale)
+        page = context.new_page()
+        if self.page_setup is not None:
+            self.page_setup(page)
+        return [context, page, 0]
+
+    def _discard(self, pages, scale):
+        slot = pages.pop(scale, None)
+        if slot is not None:
+            self._close_quietly(slot[0])
+
+    @staticmethod
+    def _close_quietly(target):
+        try:
+            target.close()
+        except PlaywrightError:
+            pass
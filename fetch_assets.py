@@ -0,0 +1,77 @@
+"""Download the fonts and chain images used by pendant_template.html.
+
+Run once (the Dockerfile does this at build time) so renders never depend on
+fonts.googleapis.com or the Shopify CDN:
+
+    python fetch_assets.py
+"""
+import os
+import re
+import urllib.request
+
+from page_assets import ASSETS_DIR
+
+FONTS_CSS_URL = (
+    'https://fonts.googleapis.com/css2?family=Pacifico&family=Sacramento'
+    '&family=Noto+Naskh+Arabic&family=Amiri&family=Cairo&display=swap'
+)
+# TrueType copies for the Pillow renderer, keyed by the file name it expects
+TTF_FAMILIES = {
+    'Pacifico.ttf': 'Pacifico',
+    'Sacramento.ttf': 'Sacramento',
+    'Amiri.ttf': 'Amiri',
+    'Cairo.ttf': 'Cairo',
+    'Noto_Naskh_Arabic.ttf': 'Noto+Naskh+Arabic',
+}
+CHAIN_IMAGES = {
+    'chain-left.png': 'https://cdn.shopify.com/s/files/1/0622/1945/2489/files/Untitled_design_11.png?v=1746956405',
+    'chain-right.png': 'https://cdn.shopify.com/s/files/1/0622/1945/2489/files/Untitled_design_12.png?v=1746956409',
+}
+# Google Fonts picks the font format from the User-Agent; ask for woff2
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+
+
+def download(url, user_agent=USER_AGENT):
+    req = urllib.request.Request(url, headers={'User-Agent': user_agent})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.read()
+
+
+def save(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    print(f'wrote {os.path.relpath(path)} ({len(data)} bytes)')
+
+
+def fetch_fonts():
+    css = download(FONTS_CSS_URL).decode('utf-8')
+    fonts_dir = os.path.join(ASSETS_DIR, 'fonts')
+
+    def localize(match):
+        url = match.group(1)
+        filename = url.rsplit('/', 1)[-1]
+        save(os.path.join(fonts_dir, filename), download(url))
+        return f'url({filename})'
+
+    css = re.sub(r'url\((https://fonts\.gstatic\.com/[^)]+)\)', localize, css)
+    save(os.path.join(fonts_dir, 'fonts.css'), css.encode('utf-8'))
+
+
+def fetch_ttf_fonts():
+    # Without a browser User-Agent Google Fonts serves a single TrueType file
+    for filename, family in TTF_FAMILIES.items():
+        css = download(f'https://fonts.googleapis.com/css2?family={family}', user_agent='fetch_assets').decode('utf-8')
+        url = re.search(r'url\((https://fonts\.gstatic\.com/[^)]+)\)', css).group(1)
+        save(os.path.join(ASSETS_DIR, 'fonts', 'ttf', filename), download(url))
+
+
+def fetch_images():
+    for filename, url in CHAIN_IMAGES.items():
+        save(os.path.join(ASSETS_DIR, 'images', filename), download(url))
+
+
+if __name__ == '__main__':
+    fetch_fonts()
+    fetch_ttf_fonts()
+    fetch_images()
@@ -0,0 +1,514 @@
+"""Sharded on-disk storage for rendered images with retention and quotas.
+
+Files live under ``<root>/<aa>/<bb>/<filename>`` where ``aabb`` are the first
+hex digits of the render key, so no directory grows without bound and all
+variants of one render share a shard. URLs stay flat (``/images/<filename>``)
+and ``relpath`` resolves them, including legacy files still sitting directly
+in ``root``.
+
+An index of ``filename -> [relpath, size, created, accessed, etag]`` is kept in
+memory and persisted as one small file per shard,
+``<root>/.index/<aa>/<bb>.json``. A few seconds after a change only the
+shards that changed are rewritten, so saving stays cheap however many
+images are stored. At startup the shard files are read back and only shard
+directories modified after their index file (e.g. after a crash) are listed
+again. Saves merge with the file on disk under an exclusive lock, and sweeps
+pick up shard files other processes rewrote, so several processes can share
+one store. A background sweeper deletes files not accessed for ``max_age``
+seconds and evicts least-recently-accessed files while the total size is
+over ``max_bytes``.
+
+``write_async`` lets a request hand off the disk write: the bytes stay in
+``pending`` (and are served from memory) until a writer thread has
+persisted them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from metrics import IMAGE_BYTES_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = '.index'
+INDEX_LOCK = '.index.lock'
+# Single-file index written by earlier versions; migrated on first start
+LEGACY_INDEX = '.index.json'
+# Index name for legacy files sitting directly in root
+FLAT_SHARD = '_flat'
+_KEYED_NAME = re.compile(r'^pendant_([0-9a-f]{4})')
+
+
+def content_etag(data):
+    """ETag for image bytes: re-renders of one filename may not be byte-identical."""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class ImageStore:
+    def __init__(self, root, max_age=None, max_bytes=None, sweep_interval=300, low_watermark=0.9,
+                 writers=2, save_delay=5):
+        self.root = root
+        self.max_age = max_age or None
+        self.max_bytes = max_bytes or None
+        self.sweep_interval = sweep_interval
+        # Quota evictions go a little below the limit so they don't run every sweep
+        self.low_watermark = low_watermark
+        # Changes are batched into one index save at most this many seconds later
+        self.save_delay = save_delay
+        self.evictions = 0
+        self.last_sweep = None
+        self._entries = {}
+        # shard relpath -> filenames, '' for legacy files directly in root
+        self._shards = {}
+        self._bytes = 0
+        # Unsaved shards -> (added, removed) filenames, so merging with other
+        # processes keeps our changes and drops theirs only when they removed them
+        self._changes = {}
+        # shard -> mtime of its index file when we last read or wrote it
+        self._index_mtimes = {}
+        self._save_timer = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+        self._pending = {}
+        self._writes = {}
+        self._writer = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='image-writer')
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+        # Finish queued writes and save the index on exit
+        atexit.register(self.stop)
+
+    @staticmethod
+    def shard(filename):
+        match = _KEYED_NAME.match(filename)
+        prefix = match.group(1) if match else hashlib.sha1(filename.encode('utf-8')).hexdigest()[:4]
+        return os.path.join(prefix[:2], prefix[2:4])
+
+    def path(self, filename):
+        """Absolute path where ``filename`` is (or will be) stored."""
+        return os.path.join(self.root, self.shard(filename), filename)
+
+    def relpath(self, filename):
+        """Path of an existing ``filename`` relative to ``root``, or None."""
+        if not filename or os.path.basename(filename) != filename or filename.startswith('.'):
+            return None
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None:
+            return entry[0]
+        # Not indexed yet (or written by another process): check the disk
+        for relpath in (os.path.join(self.shard(filename), filename), filename):
+            if os.path.isfile(os.path.join(self.root, relpath)):
+                self._record(filename, relpath)
+                return relpath
+        return None
+
+    def exists(self, filename):
+        with self._lock:
+            if filename in self._pending:
+                return True
+        return self.relpath(filename) is not None
+
+    def pending(self, filename):
+        """Bytes of ``filename`` if it is still waiting to be written, else None."""
+        with self._lock:
+            return self._pending.get(filename)
+
+    def read(self, filename):
+        data = self.pending(filename)
+        if data is not None:
+            return data
+        relpath = self.relpath(filename)
+        if relpath is None:
+            raise FileNotFoundError(filename)
+        with open(os.path.join(self.root, relpath), 'rb') as f:
+            return f.read()
+
+    def write(self, filename, data):
+        """Atomically write ``data`` as ``filename`` and index it."""
+        path = self.path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp{threading.get_ident()}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        IMAGE_BYTES_WRITTEN.inc(len(data))
+        self._record(filename, os.path.join(self.shard(filename), filename), content_etag(data))
+
+    def write_async(self, filename, data):
+        """Queue ``data`` to be written as ``filename``; it is readable immediately."""
+        with self._lock:
+            self._pending[filename] = data
+            future = self._writes[filename] = self._writer.submit(self._write_pending, filename, data)
+        future.add_done_callback(lambda done: self._forget_write(filename, done))
+        return future
+
+    def wait_written(self, filename, timeout=None):
+        """Block until a queued write of ``filename`` has finished (or failed)."""
+        with self._lock:
+            future = self._writes.get(filename)
+        if future is not None:
+            future.result(timeout)
+
+    def _forget_write(self, filename, future):
+        with self._lock:
+            if self._writes.get(filename) is future:
+                del self._writes[filename]
+
+    def _write_pending(self, filename, data):
+        try:
+            self.write(filename, data)
+        except Exception:
+            logger.exception('Could not persist image %s', filename)
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+    def etag(self, filename):
+        """Content hash of ``filename``, the same while pending and once on disk."""
+        data = self.pending(filename)
+        if data is not None:
+            return content_etag(data)
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and len(entry) > 4:
+            return entry[4]
+        # Indexed before hashes were kept, or found by a rescan: hash it once
+        etag = content_etag(self.read(filename))
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                del entry[4:]
+                entry.append(etag)
+                self._changed(os.path.dirname(entry[0]))
+        return etag
+
+    def touch(self, filename):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                entry[3] = time.time()
+                self._changed(os.path.dirname(entry[0]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'last_sweep': self.last_sweep,
+            }
+
+    def _record(self, filename, relpath, etag=None):
+        try:
+            size = os.path.getsize(os.path.join(self.root, relpath))
+        except OSError:
+            return
+        now = time.time()
+        entry = [relpath, size, now, now]
+        if etag is not None:
+            entry.append(etag)
+        with self._lock:
+            self._add_entry(filename, entry)
+        self._schedule_save()
+
+    def _changed(self, shard):
+        """Mark ``shard`` for saving; returns its ``(added, removed)`` sets."""
+        return self._changes.setdefault(shard, (set(), set()))
+
+    def _add_entry(self, filename, entry, track=True):
+        previous = self._entries.get(filename)
+        if previous is not None:
+            self._bytes -= previous[1]
+            self._shards.get(os.path.dirname(previous[0]), set()).discard(filename)
+        shard = os.path.dirname(entry[0])
+        self._entries[filename] = entry
+        self._shards.setdefault(shard, set()).add(filename)
+        self._bytes += entry[1]
+        if track:
+            added, removed = self._changed(shard)
+            added.add(filename)
+            removed.discard(filename)
+
+    def _drop_entry(self, filename, track=True):
+        entry = self._entries.pop(filename, None)
+        if entry is None:
+            return None
+        shard = os.path.dirname(entry[0])
+        self._bytes -= entry[1]
+        self._shards.get(shard, set()).discard(filename)
+        if track:
+            added, removed = self._changed(shard)
+            added.discard(filename)
+            removed.add(filename)
+        return entry
+
+    def _remove(self, filename):
+        with self._lock:
+            entry = self._drop_entry(filename)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.root, entry[0]))
+        except FileNotFoundError:
+            pass
+        self._schedule_save()
+
+    def sweep(self):
+        """Apply the retention and quota policies once; returns files evicted."""
+        # Other processes may have added or evicted files since we last looked
+        self._refresh()
+        now = time.time()
+        evicted = 0
+        with self._lock:
+            expired = [name for name, entry in self._entries.items()
+                       if self.max_age and now - entry[3] > self.max_age]
+        for name in expired:
+            self._remove(name)
+            evicted += 1
+
+        if self.max_bytes:
+            with self._lock:
+                over = self._bytes > self.max_bytes
+                by_access = sorted(self._entries.items(), key=lambda item: item[1][3]) if over else []
+            target = self.max_bytes * self.low_watermark
+            for name, _ in by_access:
+                if self._bytes <= target:
+                    break
+                self._remove(name)
+                evicted += 1
+
+        with self._lock:
+            self.evictions += evicted
+            self.last_sweep = now
+        if evicted:
+            logger.info('Image sweep evicted %d files', evicted)
+        self.save_index()
+        return evicted
+
+    def start_sweeper(self):
+        if self._sweeper is not None or not (self.max_age or self.max_bytes):
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='image-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        self.save_index()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Image sweep failed')
+
+    def _schedule_save(self):
+        with self._lock:
+            if self._save_timer is not None or self._stop.is_set():
+                return
+            self._save_timer = threading.Timer(self.save_delay, self._deferred_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _deferred_save(self):
+        with self._lock:
+            self._save_timer = None
+        try:
+            self.save_index()
+        except OSError:
+            logger.exception('Could not save image index')
+
+    def _index_path(self, shard):
+        return os.path.join(self.root, INDEX_DIR, (shard or FLAT_SHARD) + '.json')
+
+    def _index_files(self):
+        """Yield ``(shard, path)`` for every shard index file on disk."""
+        index_dir = os.path.join(self.root, INDEX_DIR)
+        if not os.path.isdir(index_dir):
+            return
+        for first in os.scandir(index_dir):
+            if first.is_file() and first.name == FLAT_SHARD + '.json':
+                yield '', first.path
+            elif first.is_dir():
+                for entry in os.scandir(first.path):
+                    if entry.name.endswith('.json'):
+                        yield os.path.join(first.name, entry.name[:-len('.json')]), entry.path
+
+    def save_index(self):
+        """Write the index of every changed shard, merged with its copy on disk."""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        if not changes:
+            return
+        with open(os.path.join(self.root, INDEX_LOCK), 'a') as lock_file:
+            # Other processes sharing the store save under the same lock
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for shard, (added, removed) in changes.items():
+                try:
+                    self._save_shard(shard, added, removed)
+                except OSError:
+                    logger.exception('Could not save the image index of shard %r', shard)
+                    # Keep the changes for the next save, unless newer ones supersede them
+                    with self._lock:
+                        newer_added, newer_removed = self._changed(shard)
+                        newer_added.update(added - newer_removed)
+                        newer_removed.update(removed - newer_added)
+
+    def _save_shard(self, shard, added, removed):
+        path = self._index_path(shard)
+        try:
+            on_disk = self._read_index(path) or {}
+        except ValueError:
+            # Corrupt: ours is the best copy there is
+            on_disk = None
+        with self._lock:
+            if on_disk is not None:
+                self._merge(shard, on_disk, added, removed)
+            entries = {name: list(self._entries[name]) for name in self._shards.get(shard, ())}
+        # Emptied shards keep an (empty) file so other processes see the removals
+        data = json.dumps({'entries': entries})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._index_mtimes[shard] = os.stat(path).st_mtime
+
+    def _merge(self, shard, on_disk, added=(), removed=()):
+        """Fold another process's saved view of ``shard`` into ours; call with the lock held."""
+        unsaved_added, unsaved_removed = self._changes.get(shard, ((), ()))
+        for filename, entry in on_disk.items():
+            if filename in removed or filename in unsaved_removed:
+                continue
+            mine = self._entries.get(filename)
+            if mine is None:
+                # Written by another process
+                self._add_entry(filename, entry, track=False)
+            elif entry[3] > mine[3]:
+                mine[3] = entry[3]
+        for filename in list(self._shards.get(shard, ())):
+            if filename not in on_disk and filename not in added and filename not in unsaved_added:
+                # Known to us before, since dropped by another process's sweep
+                self._drop_entry(filename, track=False)
+
+    def _refresh(self):
+        """Merge shard index files that another process rewrote since we last saw them."""
+        for shard, path in self._index_files():
+            try:
+                mtime = os.stat(path).st_mtime
+                if mtime == self._index_mtimes.get(shard):
+                    continue
+                on_disk = self._read_index(path)
+            except (OSError, ValueError):
+                continue
+            with self._lock:
+                self._merge(shard, on_disk or {})
+            self._index_mtimes[shard] = mtime
+
+    @staticmethod
+    def _read_index(path):
+        """Entries saved at ``path``, None if missing; raises ValueError if unreadable."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)['entries']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as exc:
+            raise ValueError(f'image index {path} is unreadable') from exc
+
+    def _load_index(self):
+        legacy = os.path.join(self.root, LEGACY_INDEX)
+        if os.path.isdir(os.path.join(self.root, INDEX_DIR)):
+            for shard, path in self._index_files():
+                try:
+                    entries = self._read_index(path) or {}
+                except ValueError:
+                    # The shard directory gets listed again below
+                    logger.warning('Image index %s is unreadable, rescanning its shard', path)
+                    continue
+                for filename, entry in entries.items():
+                    self._add_entry(filename, entry, track=False)
+                self._index_mtimes[shard] = os.stat(path).st_mtime
+            self._rescan_newer()
+            self.save_index()
+            return
+        try:
+            entries = self._read_index(legacy)
+        except ValueError:
+            logger.warning('Image index %s is unreadable, rescanning', legacy)
+            entries = None
+        if entries is None:
+            self._scan()
+            return
+        # Split the old single-file index into shard files
+        for filename, entry in entries.items():
+            self._add_entry(filename, entry)
+        self._rescan_newer()
+        self.save_index()
+        os.remove(legacy)
+
+    def _rescan_newer(self):
+        """List shards changed after their index was saved, e.g. files written before a crash."""
+        found = 0
+        for first in os.scandir(self.root):
+            if not first.is_dir() or first.name.startswith('.'):
+                continue
+            for shard_dir in os.scandir(first.path):
+                if not shard_dir.is_dir():
+                    continue
+                shard = os.path.join(first.name, shard_dir.name)
+                saved = self._index_mtimes.get(shard)
+                if saved is None or shard_dir.stat().st_mtime >= saved:
+                    found += self._reconcile(shard)
+        if found:
+            logger.info('Indexed %d images written after the last index save', found)
+
+    def _reconcile(self, shard):
+        """Make the index of ``shard`` match the directory; returns files added."""
+        now = time.time()
+        on_disk = {}
+        for entry in os.scandir(os.path.join(self.root, shard)):
+            if entry.is_file() and not entry.name.startswith('.') and '.tmp' not in entry.name:
+                on_disk[entry.name] = entry.stat()
+        found = 0
+        for filename in list(self._shards.get(shard, ())):
+            if filename not in on_disk:
+                self._drop_entry(filename)
+        for filename, stat in on_disk.items():
+            if filename not in self._entries:
+                # Start the idle clock now rather than expiring old files on upgrade
+                self._add_entry(filename, [os.path.join(shard, filename), stat.st_size, stat.st_mtime, now])
+                found += 1
+        return found
+
+    def _scan(self):
+        """Build the index from the tree; only needed the first time."""
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.') or '.tmp' in filename:
+                    continue
+                full = os.path.join(dirpath, filename)
+                stat = os.stat(full)
+                self._add_entry(filename, [os.path.relpath(full, self.root), stat.st_size, stat.st_mtime, now])
+        self.save_index()
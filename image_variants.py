@@ -0,0 +1,118 @@
+"""Output formats, thumbnails and content negotiation for rendered pendants.
+
+Renderers produce a lossless master image; this module encodes it into the
+requested format and queues thumbnail variants next to it in the same pass.
+Thumbnails are named ``<stem>_w<width>.<ext>``; format variants made for
+content negotiation share the stem and swap the extension.
+"""
+import io
+import mimetypes
+import os
+
+from PIL import Image
+
+# format -> (Pillow encoder, MIME type, file extension)
+FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+# Older Pythons don't map .webp, and send_file picks the Content-Type from it
+mimetypes.add_type('image/webp', '.webp')
+EXTENSION_FORMATS = {ext: fmt for fmt, (_, _, ext) in FORMATS.items()}
+DEFAULT_QUALITY = 85
+# Formats offered through Accept negotiation, best first
+NEGOTIABLE = ('webp',)
+
+
+def extension(fmt):
+    return FORMATS[fmt][2]
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][1]
+
+
+def encode(image, fmt, quality=None):
+    """Encode a Pillow ``image`` (or PNG bytes) as ``fmt`` and return the bytes."""
+    if isinstance(image, (bytes, bytearray)):
+        if fmt == 'png':
+            # Keep renderer output byte-for-byte when no transcoding is needed
+            return bytes(image)
+        image = Image.open(io.BytesIO(image))
+    encoder = FORMATS[fmt][0]
+    options = {}
+    if fmt != 'png':
+        options['quality'] = quality or DEFAULT_QUALITY
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, encoder, **options)
+    return buffer.getvalue()
+
+
+def open_image(data):
+    """Return a Pillow image for PNG bytes or an image that is already decoded."""
+    if isinstance(data, (bytes, bytearray)):
+        return Image.open(io.BytesIO(data))
+    return data
+
+
+def thumbnail(image, width):
+    image = open_image(image)
+    if width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def thumbnail_filename(filename, width):
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}_w{width}{ext}'
+
+
+def ensure_thumbnails(store, filename, widths, fmt, quality=None, master=None):
+    """Queue any missing ``widths`` thumbnails of ``filename``; returns their filenames.
+
+    ``master`` is the in-memory render when available, so a fresh render
+    never has to decode its own output again.
+    """
+    names = {}
+    for width in widths:
+        name = thumbnail_filename(filename, width)
+        if not store.exists(name):
+            if master is None:
+                master = Image.open(io.BytesIO(store.read(filename)))
+            store.write_async(name, encode(thumbnail(master, width), fmt, quality))
+        names[width] = name
+    return names
+
+
+def negotiate(filename, accept):
+    """Pick a better format for ``filename`` from an Accept header, or None.
+
+    Only PNG originals are negotiated; lossy renders were chosen explicitly.
+    """
+    stem, ext = os.path.splitext(filename)
+    if EXTENSION_FORMATS.get(ext.lstrip('.')) != 'png':
+        return None
+    png_quality = accept.quality('image/png')
+    for fmt in NEGOTIABLE:
+        # Require an explicit mention: '*/*' alone should keep the PNG
+        for value, quality in accept:
+            if value == mimetype(fmt) and quality > 0 and quality >= png_quality:
+                return fmt
+    return None
+
+
+def ensure_format_variant(store, filename, fmt):
+    """Transcode ``filename`` to ``fmt`` next to it if needed; returns the new name.
+
+    Raises ``FileNotFoundError`` when ``filename`` is not in ``store``.
+    """
+    stem, _ = os.path.splitext(filename)
+    name = f'{stem}.{extension(fmt)}'
+    if not store.exists(name):
+        with Image.open(io.BytesIO(store.read(filename))) as image:
+            store.write_async(name, encode(image, fmt))
+    return name
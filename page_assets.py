@@ -0,0 +1,118 @@
+"""Locally vendored fonts/images and render readiness for the pendant page.
+
+The template loads its fonts and chain images from ``ASSET_ORIGIN``. That
+origin never hits the network: every page in the browser pool intercepts it
+and answers from ``ASSETS_DIR`` (populated by ``fetch_assets.py``), so renders
+are identical on an offline box.
+
+Renders are cached and served as immutable, so a page whose fonts or chain
+images didn't load must never be screenshotted: ``require_assets`` refuses
+to render without the vendored files and ``wait_until_ready`` raises
+``AssetError`` when the page isn't fully loaded in time.
+"""
+from functools import lru_cache
+import logging
+import mimetypes
+import os
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = os.environ.get('ASSETS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+ASSET_ORIGIN = 'https://assets.pendant.local'
+# Files every render needs, relative to ASSETS_DIR
+REQUIRED_ASSETS = ('fonts/fonts.css', 'images/chain-left.png', 'images/chain-right.png')
+
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('font/ttf', '.ttf')
+
+# Resolves once every web font used on the page and every <img> has settled,
+# or after ``timeout`` ms, whichever comes first. Returns the list of fonts
+# and images that failed to load, or null on timeout.
+READY_SCRIPT = """
+(timeout) => {
+  const pendants = Array.from(document.querySelectorAll('.pendant'));
+  const fontsUsed = pendants.map(el => document.fonts.load(getComputedStyle(el).font, el.textContent));
+  const images = Array.from(document.images, img => img.complete ? null :
+    new Promise(resolve => {
+      img.addEventListener('load', resolve, {once: true});
+      img.addEventListener('error', resolve, {once: true});
+    }));
+  const failed = () => {
+    const loaded = new Set(Array.from(document.fonts)
+      .filter(face => face.status === 'loaded')
+      .map(face => face.family.replace(/["']/g, '')));
+    const families = new Set(pendants.map(el =>
+      getComputedStyle(el).fontFamily.split(',')[0].trim().replace(/["']/g, '')));
+    return [
+      ...Array.from(families).filter(family => !loaded.has(family)).map(family => `font ${family}`),
+      ...Array.from(document.images).filter(img => !img.naturalWidth).map(img => img.src),
+    ];
+  };
+  const ready = Promise.all([...fontsUsed, ...images])
+    .then(() => document.fonts.ready)
+    .then(failed, failed);
+  const expired = new Promise(resolve => setTimeout(() => resolve(null), timeout));
+  return Promise.race([ready, expired]);
+}
+"""
+
+
+class AssetError(RuntimeError):
+    """The page's fonts or images are unavailable, so a render would be wrong."""
+
+
+def missing_assets():
+    return [name for name in REQUIRED_ASSETS if not os.path.isfile(os.path.join(ASSETS_DIR, name))]
+
+
+def require_assets():
+    """Raise ``AssetError`` unless the vendored assets are in place."""
+    missing = missing_assets()
+    if missing:
+        raise AssetError(f"missing {', '.join(missing)} in {ASSETS_DIR}; run fetch_assets.py")
+
+
+def asset_path(url):
+    """Map an ``ASSET_ORIGIN`` URL to a file inside ``ASSETS_DIR`` (or None)."""
+    path = os.path.normpath(urlsplit(url).path.lstrip('/'))
+    if path.startswith('..') or os.path.isabs(path):
+        return None
+    return os.path.join(ASSETS_DIR, path)
+
+
+@lru_cache(maxsize=128)
+def _read_asset(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def serve_asset(route):
+    path = asset_path(route.request.url)
+    if path is None or not os.path.isfile(path):
+        logger.warning('Missing pendant asset %s (run fetch_assets.py)', route.request.url)
+        route.fulfill(status=404, body='', headers={'Access-Control-Allow-Origin': '*'})
+        return
+    route.fulfill(
+        status=200,
+        body=_read_asset(path),
+        content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        headers={'Access-Control-Allow-Origin': '*'},
+    )
+
+
+def install_asset_routes(page):
+    """Serve ``ASSET_ORIGIN`` requests from disk for the lifetime of ``page``."""
+    page.route(f'{ASSET_ORIGIN}/**', serve_asset)
+
+
+def wait_until_ready(page, timeout_ms):
+    """Block until fonts and images are loaded.
+
+    Raises ``AssetError`` on timeout or when any of them failed to load.
+    """
+    failed = page.evaluate(READY_SCRIPT, timeout_ms)
+    if failed is None:
+        raise AssetError(f'pendant page not ready after {timeout_ms}ms')
+    if failed:
+        raise AssetError(f"pendant page failed to load {', '.join(failed)}")
@@ -0,0 +1,72 @@
+"""Compare the Pillow renderer against the Chromium render of the same pendant.
+
+Renders each name with both backends and fails when the fraction of pixels
+that differ by more than ``--threshold`` (max channel delta) exceeds
+``--tolerance``. Needs Chromium and the vendored assets:
+
+    python fetch_assets.py
+    python parity_check.py --tolerance 0.02 --diff-dir parity
+"""
+import argparse
+import io
+import os
+import sys
+
+from PIL import Image, ImageChops
+
+import app
+
+DEFAULT_NAMES = ['Thaamu', 'Fidha', 'Alexandria', 'Jo', 'Émilie', 'Zoë Kay']
+
+
+def compare(expected, actual, threshold):
+    """Return the fraction of pixels whose max channel delta exceeds ``threshold``."""
+    diff = ImageChops.difference(expected.convert('RGB'), actual.convert('RGB'))
+    red, green, blue = diff.split()
+    delta = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    differing = sum(delta.histogram()[threshold + 1:])
+    return differing / (expected.width * expected.height), diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', default=DEFAULT_NAMES)
+    parser.add_argument('--font', default='pacifico', choices=sorted(app.FONTS))
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='max fraction of differing pixels (default 0.02)')
+    parser.add_argument('--threshold', type=int, default=32,
+                        help='per-pixel channel delta counted as a difference (default 32)')
+    parser.add_argument('--diff-dir', help='write chromium/pillow/diff images here')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for name in args.names:
+        pendant = app.parse_pendant({'name': name, 'font': args.font, 'engine': 'pillow'})
+        if pendant['engine'] != 'pillow':
+            print(f'SKIP {name!r}: not supported by the Pillow renderer')
+            continue
+        expected = Image.open(io.BytesIO(app.render_pendant({**pendant, 'engine': 'chromium'})))
+        actual = app.pillow_renderer.render_image(pendant)
+
+        if expected.size != actual.size:
+            print(f'FAIL {name!r}: size {actual.size} != chromium {expected.size}')
+            failures += 1
+            continue
+        fraction, diff = compare(expected, actual, args.threshold)
+        ok = fraction <= args.tolerance
+        failures += not ok
+        print(f'{"PASS" if ok else "FAIL"} {name!r}: {fraction:.2%} of pixels differ')
+
+        if args.diff_dir:
+            os.makedirs(args.diff_dir, exist_ok=True)
+            stem = os.path.join(args.diff_dir, name.replace(' ', '_'))
+            expected.save(f'{stem}.chromium.png')
+            actual.convert('RGB').save(f'{stem}.pillow.png')
+            diff.save(f'{stem}.diff.png')
+
+    app.browser_pool.shutdown()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
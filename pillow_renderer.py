@@ -0,0 +1,180 @@
+"""Browser-free pendant renderer built on Pillow/FreeType.
+
+For plain names the pendant page is just two chain images around a line of
+gold text, so it can be composited directly instead of launching Chromium.
+The layout and effects mirror the ``.pendant-wrapper``/``.pendant`` rules in
+``pendant_template.html``; ``parity_check.py`` compares the two backends.
+Pendants this renderer cannot reproduce faithfully (RTL text without raqm
+shaping, missing fonts, characters the font has no glyph for, names wider
+than the viewport) report ``supports() == False`` so the caller can fall back to Chromium.
+"""
+import os
+import threading
+import unicodedata
+
+from fontTools.ttLib import TTFont
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, features
+
+from page_assets import ASSETS_DIR
+
+# Mirrors of the template's CSS
+BACKGROUND = (0xff, 0xfd, 0xfa, 255)
+PADDING = (40, 32, 32, 32)  # top, right, bottom, left
+CHAIN_HEIGHT = 160
+FONT_SIZE = 56
+TEXT_COLOR = (0xff, 0xcf, 0x3c, 255)
+# text-shadow layers as (dx, dy, blur radius, rgba); the first is painted on top
+TEXT_SHADOWS = [
+    (1, 1, 2, (255, 215, 0, 128)),
+    (2, 2, 8, (0, 0, 0, 102)),
+]
+# filter: drop-shadow(0 3px 3px rgba(0, 0, 0, 0.5)) on the whole text element
+DROP_SHADOW = (0, 3, 3, (0, 0, 0, 128))
+
+FONT_FILES = {
+    'pacifico': 'Pacifico.ttf',
+    'sacramento': 'Sacramento.ttf',
+    'amiri': 'Amiri.ttf',
+    'cairo': 'Cairo.ttf',
+    'noto-naskh-arabic': 'Noto_Naskh_Arabic.ttf',
+}
+CHAIN_FILES = ('chain-left.png', 'chain-right.png')
+
+HAS_RAQM = features.check('raqm')
+
+
+def _has_rtl(text):
+    return any(unicodedata.bidirectional(ch) in ('R', 'AL') for ch in text)
+
+
+def _shadow(mask, dx, dy, blur, color, size):
+    """A blurred, offset, tinted copy of ``mask`` as an RGBA layer of ``size``."""
+    alpha = mask.point(lambda a: a * color[3] // 255)
+    layer = Image.new('RGBA', size, color[:3] + (0,))
+    shifted = Image.new('L', size, 0)
+    shifted.paste(alpha, (dx, dy))
+    if blur:
+        # CSS blur radii are twice the Gaussian standard deviation
+        shifted = shifted.filter(ImageFilter.GaussianBlur(blur / 2))
+    layer.putalpha(shifted)
+    return layer
+
+
+class PillowRenderer:
+    def __init__(self, assets_dir=ASSETS_DIR, viewport_width=1000):
+        self.fonts_dir = os.path.join(assets_dir, 'fonts', 'ttf')
+        self.images_dir = os.path.join(assets_dir, 'images')
+        self.viewport_width = viewport_width
+        self._fonts = {}
+        self._cmaps = {}
+        self._chains = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return all(os.path.isfile(os.path.join(self.images_dir, f)) for f in CHAIN_FILES)
+
+    def supports(self, pendant):
+        """Whether ``pendant`` can be rendered here without losing fidelity."""
+        if not self.available():
+            return False
+        if not os.path.isfile(os.path.join(self.fonts_dir, FONT_FILES[pendant['font']])):
+            return False
+        # Chromium falls back to system fonts; FreeType would draw .notdef boxes
+        if not self.covers(pendant['font'], pendant['name']):
+            return False
+        if (pendant['direction'] == 'rtl' or _has_rtl(pendant['name'])) and not HAS_RAQM:
+            return False
+        width, _, _, _ = self._layout(pendant)
+        # Chromium would start shrinking/wrapping the flex items past the viewport
+        return width <= self.viewport_width
+
+    def covers(self, key, text):
+        """Whether font ``key`` has a glyph for every visible character of ``text``."""
+        cmap = self._cmap(key)
+        # Format characters (ZWJ, bidi marks) are consumed by shaping, not drawn
+        return all(ord(ch) in cmap for ch in text if unicodedata.category(ch) != 'Cf')
+
+    def render_image(self, pendant):
+        left, right = self._chain_images()
+        font = self._font(pendant['font'])
+        width, height, text_width, text_height = self._layout(pendant)
+        top, _, _, pad_left = PADDING
+        content_height = height - PADDING[0] - PADDING[2]
+
+        canvas = Image.new('RGBA', (width, height), BACKGROUND)
+        # align-items: center within the content box
+        canvas.alpha_composite(left, (pad_left, top + (content_height - left.height) // 2))
+        text_x = pad_left + left.width
+        canvas.alpha_composite(right, (text_x + text_width, top + (content_height - right.height) // 2))
+
+        element = self._text_element(pendant, font, text_width, text_height)
+        margin = (element.width - text_width) // 2
+        text_y = top + (content_height - text_height) // 2
+        canvas.alpha_composite(element, (text_x - margin, text_y - margin))
+        return canvas
+
+    def _text_element(self, pendant, font, text_width, text_height):
+        """The text box with its text-shadows and drop-shadow, padded for blur bleed."""
+        # Room for the widest shadow: 2px offset + 8px blur, then the drop-shadow
+        margin = 24
+        size = (text_width + 2 * margin, text_height + 2 * margin)
+        ascent, _ = font.getmetrics()
+
+        mask = Image.new('L', size, 0)
+        kwargs = {'direction': pendant['direction']} if HAS_RAQM else {}
+        ImageDraw.Draw(mask).text((margin, margin + ascent), pendant['name'], font=font,
+                                  fill=255, anchor='ls', **kwargs)
+
+        element = Image.new('RGBA', size, (0, 0, 0, 0))
+        for dx, dy, blur, color in reversed(TEXT_SHADOWS):
+            element.alpha_composite(_shadow(mask, dx, dy, blur, color, size))
+        text = Image.new('RGBA', size, TEXT_COLOR[:3] + (0,))
+        text.putalpha(mask)
+        element.alpha_composite(text)
+
+        dx, dy, blur, color = DROP_SHADOW
+        result = _shadow(element.getchannel('A'), dx, dy, blur, color, size)
+        result.alpha_composite(element)
+        return result
+
+    def _layout(self, pendant):
+        """Return ``(width, height, text_width, text_height)`` of the wrapper."""
+        left, right = self._chain_images()
+        font = self._font(pendant['font'])
+        kwargs = {'direction': pendant['direction']} if HAS_RAQM else {}
+        text_width = round(font.getlength(pendant['name'], **kwargs))
+        ascent, descent = font.getmetrics()
+        text_height = ascent + descent
+        width = PADDING[3] + left.width + text_width + right.width + PADDING[1]
+        height = PADDING[0] + max(left.height, right.height, text_height) + PADDING[2]
+        return width, height, text_width, text_height
+
+    def _font(self, key):
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is None:
+                layout = ImageFont.Layout.RAQM if HAS_RAQM else ImageFont.Layout.BASIC
+                path = os.path.join(self.fonts_dir, FONT_FILES[key])
+                font = self._fonts[key] = ImageFont.truetype(path, FONT_SIZE, layout_engine=layout)
+            return font
+
+    def _cmap(self, key):
+        with self._lock:
+            cmap = self._cmaps.get(key)
+            if cmap is None:
+                with TTFont(os.path.join(self.fonts_dir, FONT_FILES[key]), lazy=True) as font:
+                    cmap = self._cmaps[key] = frozenset(font.getBestCmap() or ())
+            return cmap
+
+    def _chain_images(self):
+        with self._lock:
+            if self._chains is None:
+                chains = []
+                for filename in CHAIN_FILES:
+                    with Image.open(os.path.join(self.images_dir, filename)) as img:
+                        img = img.convert('RGBA')
+                        # .chain-img { height: 160px } keeps the aspect ratio
+                        width = round(img.width * CHAIN_HEIGHT / img.height)
+                        chains.append(img.resize((width, CHAIN_HEIGHT), Image.LANCZOS))
+                self._chains = tuple(chains)
+            return self._chains
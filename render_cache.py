@@ -0,0 +1,174 @@
+"""Content-addressed cache of rendered pendant images.
+
+Images are stored as ``pendant_<key>.png`` where the key hashes the
+normalized name, the template source, a ``version`` digest of everything
+else a render depends on (vendored assets, renderer code and versions) and
+the render options, so an identical request can reuse the file already on
+disk without touching Chromium, and a given filename always means the same
+image. A bounded in-memory LRU index avoids hitting the filesystem for
+popular names, and concurrent misses for the same key share one render.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+
+
+def normalize_name(name):
+    return unicodedata.normalize('NFC', name)
+
+
+def digest_paths(paths, *parts):
+    """Hash the contents of ``paths`` (files or directory trees) plus ``parts``."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(f'{part}\0'.encode('utf-8'))
+    for root in paths:
+        files = [root] if os.path.isfile(root) else sorted(
+            os.path.join(dirpath, filename)
+            for dirpath, _, filenames in os.walk(root) for filename in filenames
+        )
+        for path in files:
+            digest.update(f'{os.path.relpath(path, root)}\0'.encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    def __init__(self, store, template_path, max_entries=4096, version=''):
+        self.store = store
+        self.template_path = template_path
+        self.version = version
+        self.max_entries = max(1, int(max_entries))
+        self._index = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._template_mtime = None
+        self._template_hash = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def template_hash(self):
+        """Hash of the template source, re-read whenever the file changes."""
+        mtime = os.stat(self.template_path).st_mtime_ns
+        with self._lock:
+            if mtime == self._template_mtime:
+                return self._template_hash
+        with open(self.template_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            if self._template_hash is not None and digest != self._template_hash:
+                # Every indexed image was rendered from the old template
+                self._index.clear()
+                self.invalidations += 1
+            self._template_mtime = mtime
+            self._template_hash = digest
+        return digest
+
+    def key(self, name, options=None):
+        payload = json.dumps(
+            [normalize_name(name), self.template_hash(), self.version, options or {}],
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def filename(self, key, ext='png'):
+        return f'pendant_{key}.{ext}'
+
+    def lookup(self, name, options=None, ext='png'):
+        """Return the cached filename for ``name`` if it is stored, else None."""
+        key = self.key(name, options)
+        with self._lock:
+            filename = self._index.get(key)
+        if filename is None:
+            # Not indexed (restart or LRU drop) but possibly still on disk
+            filename = self.filename(key, ext)
+            if not self.store.exists(filename):
+                return None
+        elif not self.store.exists(filename):
+            # Swept from disk since it was indexed
+            with self._lock:
+                self._index.pop(key, None)
+            return None
+        self.store.touch(filename)
+        with self._lock:
+            self._remember(key, filename)
+            self.hits += 1
+        return filename
+
+    def get_or_render(self, name, options, render, ext='png'):
+        """Return ``(filename, hit)`` for ``name``, calling ``render()`` on a miss.
+
+        ``render`` returns the encoded image bytes, which the store persists
+        in the background while serving them from memory. Concurrent callers
+        with the same key wait for a single render.
+        """
+        key = self.key(name, options)
+        filename = self.filename(key, ext)
+
+        with self._lock:
+            indexed = key in self._index
+        if indexed and self.store.exists(filename):
+            # Keep the store's access time fresh so quota eviction spares it
+            self.store.touch(filename)
+            with self._lock:
+                self._remember(key, filename)
+                self.hits += 1
+            return filename, True
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            # Another request is already rendering this key; share its result
+            inflight.result()
+            return filename, True
+
+        try:
+            if self.store.exists(filename):
+                hit = True
+                self.store.touch(filename)
+            else:
+                hit = False
+                self.store.write_async(filename, render())
+            with self._lock:
+                self._remember(key, filename)
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            inflight.set_result(filename)
+            return filename, hit
+        except BaseException as exc:
+            inflight.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _remember(self, key, filename):
+        self._index[key] = filename
+        self._index.move_to_end(key)
+        while len(self._index) > self.max_entries:
+            self._index.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'invalidations': self.invalidations,
+                'indexed': len(self._index),
+            }
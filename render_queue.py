@@ -0,0 +1,147 @@
+"""Bounded in-process queue of render jobs served by a fixed set of workers.
+
+Requests submit a job and get an id back immediately instead of holding a
+Flask worker for the whole browser session. When the queue is full
+``submit`` raises ``QueueFull`` carrying a retry hint, which the app turns
+into ``429 Too Many Requests`` with ``Retry-After``.
+"""
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+
+from metrics import RENDER_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'render queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, fn, deadline):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.deadline = self.created + deadline
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False if ``timeout`` ran out."""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.monotonic()
+        self.fn = None
+        self._done.set()
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status}
+        if self.result is not None:
+            data.update(self.result)
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class RenderQueue:
+    def __init__(self, workers=2, max_depth=64, deadline=60, retention=600):
+        self.workers = max(1, int(workers))
+        self.max_depth = max(1, int(max_depth))
+        self.deadline = float(deadline)
+        self.retention = float(retention)
+        self._queue = queue.Queue(maxsize=self.max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._avg_duration = 1.0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'render-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, deadline=None):
+        """Queue ``fn()`` for a worker and return its ``Job``.
+
+        ``fn`` must return a dict that becomes part of the job's status
+        payload. Raises ``QueueFull`` when ``max_depth`` jobs are waiting.
+        """
+        self.start()
+        job = Job(fn, self.deadline if deadline is None else float(deadline))
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFull(self.retry_after())
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up, based on recent renders."""
+        return max(1, math.ceil(self.depth() * self._avg_duration / self.workers))
+
+    def _prune(self):
+        now = time.monotonic()
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.done and now - job.finished >= self.retention]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if time.monotonic() > job.deadline:
+                job._finish(EXPIRED, error='job deadline passed before rendering started')
+                continue
+            job.status = RUNNING
+            started = time.monotonic()
+            RENDER_STAGE_SECONDS.observe(started - job.created, stage='queue_wait')
+            try:
+                job._finish(DONE, result=job.fn())
+            except (TimeoutError, FutureTimeoutError):
+                logger.warning('Render job %s timed out', job.id)
+                job._finish(FAILED, error='render timed out')
+            except Exception as exc:
+                logger.exception('Render job %s failed', job.id)
+                # Some exceptions carry no message; report at least their type
+                job._finish(FAILED, error=str(exc) or type(exc).__name__)
+            duration = time.monotonic() - started
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
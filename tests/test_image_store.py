@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from image_store import ImageStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    opened = []
+
+    def open_store(**kwargs):
+        store = ImageStore(str(tmp_path), **kwargs)
+        opened.append(store)
+        return store
+
+    yield open_store
+    for store in opened:
+        store.stop()
+
+
+def test_stores_merge_each_others_additions(stores):
+    a = stores()
+    b = stores()
+    a.write('pendant_aaaa01.png', b'a' * 10)
+    a.save_index()
+    b.write('pendant_aaaa02.png', b'b' * 10)
+    b.save_index()
+
+    a.sweep()
+
+    assert a.stats()['files'] == 2
+    assert a.stats()['bytes'] == 20
+    # A fresh process sees both without rescanning the disk
+    assert stores().stats()['files'] == 2
+
+
+def test_stores_merge_each_others_removals(stores):
+    a = stores()
+    a.write('pendant_aaaa01.png', b'a' * 10)
+    a.write('pendant_bbbb01.png', b'b' * 10)
+    a.save_index()
+    b = stores(max_bytes=1)
+
+    assert b.sweep() == 2
+    a.sweep()
+
+    assert a.stats()['files'] == 0
+    assert not a.exists('pendant_aaaa01.png')
+    # A's next save must not bring the evicted entries back
+    a.save_index()
+    assert stores().stats()['files'] == 0
+
+
+def test_quota_evicts_least_recently_accessed(stores):
+    store = stores(max_bytes=250)
+    for name in ('pendant_aaaa01.png', 'pendant_bbbb01.png', 'pendant_cccc01.png'):
+        store.write(name, b'x' * 100)
+        time.sleep(0.01)
+    store.touch('pendant_aaaa01.png')
+
+    assert store.sweep() == 1
+
+    assert store.exists('pendant_aaaa01.png')
+    assert not store.exists('pendant_bbbb01.png')
+    assert store.exists('pendant_cccc01.png')
+    assert store.stats()['bytes'] == 200
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from image_store import ImageStore
+from render_cache import RenderCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ImageStore(str(tmp_path / 'images'))
+    yield store
+    store.stop()
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / 'template.html'
+    path.write_text('<div>{{ name }}</div>')
+    return str(path)
+
+
+def test_concurrent_misses_share_one_render(store, template):
+    cache = RenderCache(store, template)
+    release = threading.Event()
+    calls = []
+
+    def render():
+        calls.append(1)
+        release.wait(5)
+        return b'png'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_render('Fidha', {}, render)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()['coalesced'] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len({filename for filename, _ in results}) == 1
+    assert sorted(hit for _, hit in results) == [False, True, True, True]
+    assert cache.stats()['misses'] == 1
+
+
+def test_lookup_finds_images_stored_before_a_restart(store, template):
+    filename, hit = RenderCache(store, template).get_or_render('Fidha', {}, lambda: b'png')
+    assert not hit
+    store.wait_written(filename)
+
+    restarted = RenderCache(store, template)
+
+    assert restarted.lookup('Fidha', {}) == filename
+    assert restarted.get_or_render('Fidha', {}, lambda: pytest.fail('rendered again')) == (filename, True)
@@ -0,0 +1,22 @@
+import threading
+
+import pytest
+
+from render_queue import QueueFull, RenderQueue
+
+
+def test_full_queue_raises_with_retry_after():
+    render_queue = RenderQueue(workers=1, max_depth=1)
+    release = threading.Event()
+    running = render_queue.submit(lambda: release.wait(5) and {})
+    while running.status == 'queued':
+        threading.Event().wait(0.01)
+    queued = render_queue.submit(lambda: {})
+
+    with pytest.raises(QueueFull) as excinfo:
+        render_queue.submit(lambda: {})
+
+    assert excinfo.value.retry_after >= 1
+    assert str(excinfo.value.retry_after) in str(excinfo.value)
+    release.set()
+    assert queued.wait(5)